@@ -4,31 +4,45 @@ from __future__ import annotations
 # ------------------------------------------------------------------
 # Standard library
 # ------------------------------------------------------------------
+import asyncio
+import atexit
+import collections
+import copy
+import ctypes
+import hashlib
 import logging
+import logging.handlers
+import ntpath
 import queue
+import re
 import subprocess
 import threading
 import time
 from functools import wraps
+from operator import itemgetter
 from pathlib import Path
-from statistics import mean
 from typing import List, Optional
 
 # ------------------------------------------------------------------
 # Third‑party
 # ------------------------------------------------------------------
+import numpy as np
+import orjson
 import psutil
 import pythoncom  # COM initialisation helper (pywin32)
 from flask import (
     Flask,
     Response,
     flash,
-    jsonify,
+    get_flashed_messages,
     redirect,
-    render_template_string,
+    render_template,
     request,
+    session,
+    stream_template,
     url_for,
 )
+from flask_caching import Cache
 from rich.logging import RichHandler
 
 # Optional (fail‑soft)
@@ -40,22 +54,54 @@ try:
     import winrm  # type: ignore
 except ImportError:
     winrm = None
+try:
+    import icmplib  # type: ignore
+except ImportError:
+    icmplib = None
+try:
+    import pywintypes  # type: ignore
+    import win32api  # type: ignore
+    import win32process  # type: ignore
+except ImportError:
+    pywintypes = win32process = None
+try:
+    import waitress  # type: ignore
+except ImportError:
+    waitress = None
 
 # ------------------------------------------------------------------
 # Logging — rotating file + colourful console
 # ------------------------------------------------------------------
 LOG_DIR = Path("logs"); LOG_DIR.mkdir(exist_ok=True)
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s | %(levelname)-8s | %(name)s | %(message)s",
-    datefmt="%Y‑%m‑%d %H:%M:%S",
-    handlers=[
-        logging.handlers.RotatingFileHandler(
-            LOG_DIR / "win_sys_mgmt.log", maxBytes=5_000_000, backupCount=5, encoding="utf‑8"
-        ),
-        RichHandler(rich_tracebacks=True, markup=True),
-    ],
+_LOG_FMT = logging.Formatter(
+    "%(asctime)s | %(levelname)-8s | %(name)s | %(message)s", datefmt="%Y‑%m‑%d %H:%M:%S"
+)
+_file_handler = logging.handlers.RotatingFileHandler(
+    LOG_DIR / "win_sys_mgmt.log", maxBytes=5_000_000, backupCount=5, encoding="utf‑8"
 )
+_rich_handler = RichHandler(rich_tracebacks=True, markup=True)
+for _h in (_file_handler, _rich_handler):
+    _h.setFormatter(_LOG_FMT)
+
+
+class _InProcessQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that keeps ``exc_info`` so RichHandler can still render tracebacks.
+
+    The stock ``prepare`` flattens the traceback into text for pickling; our queue
+    never leaves the process, so only the message args are merged."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg, record.args = record.getMessage(), None
+        return record
+
+
+# Request threads only enqueue records; file/console I/O happens on the listener thread
+_qh = _InProcessQueueHandler(queue.SimpleQueue())
+_listener = logging.handlers.QueueListener(_qh.queue, _file_handler, _rich_handler, respect_handler_level=True)
+_listener.start()
+atexit.register(_listener.stop)
+logging.basicConfig(level=logging.INFO, handlers=[_qh])
 logger = logging.getLogger("win_sys_mgmt")
 
 
@@ -63,7 +109,8 @@ def route_log(fn):
     """Decorator to journal every HTTP call with method & endpoint."""
     @wraps(fn)
     def wrapper(*args, **kwargs):  # type: ignore[misc]
-        logger.info("HTTP %s %s", request.method, request.path)
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("HTTP %s %s", request.method, request.path)
         return fn(*args, **kwargs)
     return wrapper
 
@@ -71,21 +118,26 @@ def route_log(fn):
 # Core Managers
 # ------------------------------------------------------------------
 class LocalWMIManager:
-    """WMI helper (auto COM initialisation per thread)."""
+    """WMI helper (COM initialised for the creating thread — see :func:`get_wmi`)."""
 
     def __init__(self):
         if wmi is None:
             raise RuntimeError("Missing wmi package — pip install wmi")
         pythoncom.CoInitialize()
-        self._com_initialised = True
         self._wmi = wmi.WMI()
 
     # ------------ Process API ------------
-    def list_processes(self):
-        return [
-            dict(pid=p.ProcessId, name=p.Caption, cmd=p.CommandLine)
-            for p in self._wmi.Win32_Process()
-        ]
+    @staticmethod
+    def list_processes():
+        # psutil reads the process table directly — far cheaper than marshalling
+        # every Win32_Process row over COM, and needs no COM/WMI context at all.
+        # ``_name_lc``/``_cmd_lc`` are lower‑cased once here for search & sort.
+        procs = []
+        for p in psutil.process_iter(["pid", "name", "cmdline"]):
+            name = p.info["name"] or ""
+            cmd = " ".join(p.info["cmdline"] or [])
+            procs.append(dict(pid=p.info["pid"], name=name, cmd=cmd, _name_lc=name.lower(), _cmd_lc=cmd.lower()))
+        return procs
 
     def kill(self, pid: int):
         (self._wmi.Win32_Process(ProcessId=pid)[0]).Terminate()
@@ -96,6 +148,10 @@ class LocalWMIManager:
         logger.info("Started %s (PID %d)", exe, pid)
         return pid
 
+    def watch_process_creation(self, delay_secs: int = 1):
+        """WMI watcher yielding each new ``Win32_Process`` (``__InstanceCreationEvent``)."""
+        return self._wmi.Win32_Process.watch_for(notification_type="Creation", delay_secs=delay_secs)
+
     # ------------ Service API -----------
     def list_services(self):
         return [
@@ -103,10 +159,29 @@ class LocalWMIManager:
             for s in self._wmi.Win32_Service()
         ]
 
-    # ------------ Cleanup --------------
-    def __del__(self):
-        if getattr(self, "_com_initialised", False):
-            pythoncom.CoUninitialize()
+
+_tls = threading.local()
+
+
+def get_wmi() -> LocalWMIManager:
+    """Return this thread's cached :class:`LocalWMIManager` (built on first use)."""
+    mgr = getattr(_tls, "mgr", None)
+    if mgr is None:
+        mgr = _tls.mgr = LocalWMIManager()
+    return mgr
+
+
+def release_wmi():
+    """Drop this thread's manager and uninitialise COM.
+
+    Long‑lived WSGI worker threads keep theirs for good; short‑lived threads
+    (e.g. each :class:`RestrictionPolicy`) call this on exit so restarts don't
+    leak a COM apartment and WMI bind per thread."""
+    mgr = getattr(_tls, "mgr", None)
+    if mgr is not None:
+        del _tls.mgr
+        del mgr  # release the WMI COM objects before CoUninitialize
+        pythoncom.CoUninitialize()
 
 
 class RemoteWinRMManager:
@@ -119,15 +194,130 @@ class RemoteWinRMManager:
         self.session = winrm.Session(
             f"{proto}://{host}:5985/wsman", auth=(user, pwd), transport="ntlm"
         )
+        # pywinrm sessions aren't thread‑safe (lazy transport setup, shared NTLM
+        # sequence numbers) and pooled managers are shared across WSGI threads
+        self._lock = threading.Lock()
 
     def run_cmd(self, cmd: str) -> str:
         logger.info("WinRM %s $ %s", self.session.url, cmd)
-        res = self.session.run_cmd(cmd)
+        with self._lock:
+            res = self.session.run_cmd(cmd)
         return (res.std_out or res.std_err).decode(errors="ignore")
 
+
+# Pooled WinRM managers keyed on (host, user, sha256(pwd)) → (created, manager),
+# least‑recently used first. Trade‑off: reusing a session skips the NTLM/TCP
+# handshake, but keeps the credentials in process memory. Expiry is lazy —
+# entries older than WINRM_SESSION_TTL are dropped on the next get_winrm()
+# call, so an idle pool holds them until then; at most WINRM_POOL_SIZE are kept.
+WINRM_SESSION_TTL = 600  # seconds
+WINRM_POOL_SIZE = 32
+_winrm_sessions: collections.OrderedDict[tuple[str, str, str], tuple[float, RemoteWinRMManager]] = collections.OrderedDict()
+_winrm_lock = threading.Lock()
+
+
+def get_winrm(host: str, user: str, pwd: str) -> RemoteWinRMManager:
+    """Return a pooled :class:`RemoteWinRMManager` (rebuilt after the TTL or a password change)."""
+    key = (host, user, hashlib.sha256(pwd.encode()).hexdigest())
+    now = time.monotonic()
+    with _winrm_lock:
+        for k in [k for k, (ts, _) in _winrm_sessions.items() if now - ts > WINRM_SESSION_TTL]:
+            del _winrm_sessions[k]
+        entry = _winrm_sessions.get(key)
+        if entry is None:
+            entry = _winrm_sessions[key] = (now, RemoteWinRMManager(host, user, pwd))
+            while len(_winrm_sessions) > WINRM_POOL_SIZE:
+                _winrm_sessions.popitem(last=False)
+        else:
+            _winrm_sessions.move_to_end(key)
+    return entry[1]
+
 # ------------------------------------------------------------------
 # Policy Watchdog (thread)
 # ------------------------------------------------------------------
+PROCESS_TERMINATE = 0x0001
+PROCESS_QUERY_LIMITED_INFORMATION = 0x1000
+_KILL_ERRORS = (psutil.Error,) if pywintypes is None else (psutil.Error, pywintypes.error)
+
+if win32process is not None:
+    from ctypes import wintypes
+
+    _QueryFullProcessImageNameW = ctypes.WinDLL("kernel32").QueryFullProcessImageNameW
+    _QueryFullProcessImageNameW.argtypes = [
+        wintypes.HANDLE, wintypes.DWORD, wintypes.LPWSTR, ctypes.POINTER(wintypes.DWORD)
+    ]
+    _QueryFullProcessImageNameW.restype = wintypes.BOOL
+
+
+def _fast_enum(cache: Optional[dict[int, tuple[object, str]]] = None) -> List[tuple[int, str, object]]:
+    """``(pid, lower‑cased image name, create time)`` for every process.
+
+    Uses EnumProcesses + QueryFullProcessImageNameW directly — no psutil
+    ``Process`` objects — and falls back to psutil without pywin32.
+    *cache* maps pid → (create time, name): a name is only re‑resolved when its
+    PID is new or was reused, and PIDs that have exited are evicted."""
+    cache = {} if cache is None else cache
+    out = []
+    if win32process is None:
+        for p in psutil.process_iter(["pid", "create_time"]):
+            pid, ct = p.info["pid"], p.info["create_time"]
+            hit = cache.get(pid)
+            if hit and hit[0] == ct:
+                nm = hit[1]
+            else:
+                try:
+                    nm = p.name().lower()
+                except psutil.Error:
+                    continue
+                cache[pid] = (ct, nm)
+            out.append((pid, nm, ct))
+    else:
+        buf = ctypes.create_unicode_buffer(32768)
+        for pid in win32process.EnumProcesses():
+            try:
+                h = win32api.OpenProcess(PROCESS_QUERY_LIMITED_INFORMATION, False, pid)
+            except pywintypes.error:  # Idle/System or protected
+                continue
+            try:
+                ct = win32process.GetProcessTimes(h)["CreationTime"]
+                hit = cache.get(pid)
+                if hit and hit[0] == ct:
+                    nm = hit[1]
+                else:
+                    size = wintypes.DWORD(len(buf))
+                    if not _QueryFullProcessImageNameW(int(h), 0, buf, ctypes.byref(size)):
+                        continue
+                    nm = ntpath.basename(buf.value).lower()
+                    cache[pid] = (ct, nm)
+                out.append((pid, nm, ct))
+            finally:
+                h.Close()
+    for pid in cache.keys() - {pid for pid, _, _ in out}:
+        del cache[pid]
+    return out
+
+
+def _kill_if_unchanged(pid: int, ct: object) -> bool:
+    """Kill *pid* only if it still has create time *ct* from :func:`_fast_enum`.
+
+    The PID may have been reused since enumeration; returns False in that case."""
+    if win32process is None:
+        p = psutil.Process(pid)
+        with p.oneshot():  # share one syscall batch for kill's checks
+            if p.create_time() != ct:
+                return False
+            p.kill()
+        return True
+    h = win32api.OpenProcess(PROCESS_TERMINATE | PROCESS_QUERY_LIMITED_INFORMATION, False, pid)
+    try:
+        if win32process.GetProcessTimes(h)["CreationTime"] != ct:
+            return False
+        win32api.TerminateProcess(h, 1)
+        return True
+    finally:
+        h.Close()
+
+
 class RestrictionPolicy(threading.Thread):
     """Kill rule hierarchy
     1. If *blacklist* populated → kill any process whose name is in blacklist.
@@ -136,31 +326,80 @@ class RestrictionPolicy(threading.Thread):
 
     def __init__(self, allow: List[str], block: List[str], interval: int = 10):
         super().__init__(daemon=True)
-        self.allow = {n.lower() for n in allow}
-        self.block = {n.lower() for n in block}
+        self.allow = frozenset(n.lower() for n in allow)
+        self.block = frozenset(n.lower() for n in block)
         self.interval = interval
         self._stop = threading.Event()
+        self._name_cache: dict[int, tuple[object, str]] = {}  # pid → (create time, name)
+        # Resolve the rule hierarchy once so the scan loop is a single test per process
+        self._mode = "block" if self.block else ("allow" if self.allow else None)
+        if self._mode == "block":
+            self._predicate = self.block.__contains__
+        elif self._mode == "allow":
+            self._predicate = lambda nm: nm not in self.allow
+        else:
+            self._predicate = lambda nm: False
 
     def run(self):
-        logger.warning("Policy active — allow=%s | block=%s", self.allow or "*", self.block or "<empty>")
-        while not self._stop.is_set():
-            for p in psutil.process_iter(["pid", "name"]):
-                nm = (p.info.get("name") or "").lower()
-                kill = False
-                if self.block and nm in self.block:
-                    kill = True
-                elif self.block:  # blacklist present & nm not in block
-                    kill = False
-                elif self.allow and nm not in self.allow:
-                    kill = True
-                if kill:
-                    try:
-                        p.kill(); logger.error("Policy kill %s PID %d", nm, p.pid)
-                    except psutil.Error:
-                        pass
-            self._stop.wait(self.interval)
+        logger.warning("Policy active — allow=%s | block=%s", ", ".join(sorted(self.allow)) or "*",
+                       ", ".join(sorted(self.block)) or "<empty>")
+        try:
+            self._enforce()
+        finally:
+            release_wmi()
         logger.info("Policy stopped")
 
+    def _enforce(self):
+        if self._mode is None:  # nothing to enforce
+            self._stop.wait()
+        else:
+            # Subscribe before the sweep so nothing spawned in between is missed
+            try:
+                watcher = get_wmi().watch_process_creation()
+            except Exception as exc:
+                watcher = None
+                logger.warning("WMI process watch unavailable (%s) — polling every %ss", exc, self.interval)
+            self._sweep()  # processes that predate the subscription
+            if watcher is not None:
+                try:
+                    self._watch(watcher)
+                except Exception as exc:
+                    logger.warning("WMI process watch failed (%s) — polling every %ss", exc, self.interval)
+            if not self._stop.is_set():
+                self._poll()
+
+    def _watch(self, watcher):
+        """Kill violators as WMI reports them (``__InstanceCreationEvent``)."""
+        while not self._stop.is_set():
+            try:
+                proc = watcher(timeout_ms=500)
+            except wmi.x_wmi_timed_out:
+                continue
+            nm = (proc.Name or "").lower()
+            if self._predicate(nm):
+                try:
+                    rc, = proc.Terminate()  # reports failure (e.g. 2 = access denied), doesn't raise
+                except wmi.x_wmi:
+                    continue
+                if rc == 0:
+                    logger.error("Policy kill %s PID %d", nm, proc.ProcessId)
+                else:
+                    logger.warning("Policy kill %s PID %d failed (Terminate returned %s)", nm, proc.ProcessId, rc)
+
+    def _poll(self):
+        """Fallback: full scan every *interval* seconds."""
+        while not self._stop.wait(self.interval):
+            self._sweep()
+
+    def _sweep(self):
+        for pid, nm, ct in _fast_enum(self._name_cache):
+            if self._predicate(nm):
+                try:
+                    if _kill_if_unchanged(pid, ct):
+                        logger.error("Policy kill %s PID %d", nm, pid)
+                except _KILL_ERRORS:
+                    pass
+
     def stop(self):
         """Signal the policy thread to terminate gracefully."""
         self._stop.set()
@@ -172,48 +411,138 @@ policy: Optional[RestrictionPolicy] = None
 # ------------------------------------------------------------------
 # Network Load Generator
 # ------------------------------------------------------------------
+_PING_RE = re.compile(rb"time[=<]([\d.]+)\s*ms", re.I)
+
+
 class NetUtils:
+    # icmplib opens raw sockets on Windows regardless of ``privileged``, which a
+    # non‑elevated process may not do; cleared on the first permission error.
+    use_icmp = icmplib is not None
+
+    @staticmethod
+    def _icmp_denied():
+        NetUtils.use_icmp = False
+        logger.warning("ICMP sockets not permitted — falling back to system ping")
+
+    @staticmethod
+    def _check(r) -> float:
+        if not r.is_alive:
+            raise RuntimeError("ping failed")
+        return r.avg_rtt
+
     @staticmethod
     def single_ping(host: str) -> float:
-        """Returns latency ms (raises RuntimeError on failure)."""
-        out = subprocess.run(["ping", "-n", "1", host], capture_output=True, text=True)
-        for ln in out.stdout.splitlines():
-            if "time=" in ln.lower():
-                return float(ln.split("time=")[-1].split("ms")[0])
-        raise RuntimeError("ping failed")
+        """Returns latency ms (raises RuntimeError on failure).
+
+        Uses an in‑process ICMP socket via icmplib when available and permitted,
+        otherwise falls back to spawning the system ``ping``."""
+        if NetUtils.use_icmp:
+            try:
+                return NetUtils._check(icmplib.ping(host, count=1, timeout=1, privileged=False))
+            except icmplib.SocketPermissionError:
+                NetUtils._icmp_denied()
+        return NetUtils.system_ping(host)
+
+    @staticmethod
+    def system_ping(host: str) -> float:
+        """Latency ms via the system ``ping`` executable."""
+        out = subprocess.run(["ping", "-n", "1", host], capture_output=True)
+        return NetUtils._parse_ping(out.stdout)
+
+    @staticmethod
+    async def async_system_ping(host: str) -> float:
+        """Awaitable :meth:`system_ping` on an asyncio subprocess (no worker thread)."""
+        proc = await asyncio.create_subprocess_exec(
+            "ping", "-n", "1", host, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL
+        )
+        stdout, _ = await proc.communicate()
+        return NetUtils._parse_ping(stdout)
+
+    @staticmethod
+    def _parse_ping(stdout: bytes) -> float:
+        m = _PING_RE.search(stdout)
+        if m is None:
+            raise RuntimeError("ping failed")
+        return float(m.group(1))
+
+    @staticmethod
+    async def async_ping(host: str) -> float:
+        """Awaitable :meth:`single_ping` — icmplib coroutine, else an asyncio subprocess."""
+        if NetUtils.use_icmp:
+            try:
+                return NetUtils._check(await icmplib.async_ping(host, count=1, timeout=1, privileged=False))
+            except icmplib.SocketPermissionError:
+                NetUtils._icmp_denied()
+        return await NetUtils.async_system_ping(host)
 
 
 class NetLoadJob(threading.Thread):
-    """Continuous pings to *host*; puts results in queue (None sentinel on stop)."""
+    """Continuous pings to *host*; appends results to a bounded deque (None sentinel on stop).
+
+    Probing runs as a coroutine on the thread's own asyncio loop so stop() can
+    interrupt the paced sleep. Only the newest ``maxlen`` samples are kept, so an
+    unvisited UI cannot grow the buffer."""
 
-    def __init__(self, host: str, delay: float = 0.3):
+    def __init__(self, host: str, delay: float = 0.3, maxlen: int = 4096):
         super().__init__(daemon=True)
         self.host = host
         self.delay = delay
-        self.q: queue.Queue[float | None] = queue.Queue()
+        self.q: collections.deque[float | None] = collections.deque(maxlen=maxlen)
+        self._drain_lock = threading.Lock()
         self._stop = threading.Event()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wake: Optional[asyncio.Event] = None
 
     def run(self):
         logger.info("Net‑Load START → %s", self.host)
+        asyncio.run(self._main())
+        self.q.append(None)
+        logger.info("Net‑Load STOP → %s", self.host)
+
+    async def _main(self):
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
         while not self._stop.is_set():
             try:
-                self.q.put(NetUtils.single_ping(self.host))
+                self.q.append(await NetUtils.async_ping(self.host))
             except Exception:
-                self.q.put(float("nan"))
-            self._stop.wait(self.delay)
-        self.q.put(None)
-        logger.info("Net‑Load STOP → %s", self.host)
+                self.q.append(float("nan"))
+            try:  # paced sleep that stop() can cut short
+                await asyncio.wait_for(self._wake.wait(), self.delay)
+            except asyncio.TimeoutError:
+                pass
 
     def stop(self):
         self._stop.set()
+        if self._loop is not None and self._wake is not None:
+            try:
+                self._loop.call_soon_threadsafe(self._wake.set)
+            except RuntimeError:  # loop already closed
+                pass
+
+    def drain(self) -> List[float | None]:
+        """Atomically take every buffered sample (may end with the None sentinel)."""
+        # popleft only what is there now — appends racing with the drain stay queued
+        with self._drain_lock:
+            return [self.q.popleft() for _ in range(len(self.q))]
 
 net_job: Optional[NetLoadJob] = None
+# Guards start/stop swaps of the ``policy``/``net_job`` globals — requests run on
+# several WSGI threads, and handlers read each global once into a local.
+_state_lock = threading.Lock()
 
 # ------------------------------------------------------------------
 # Flask UI
 # ------------------------------------------------------------------
 app = Flask(__name__)
 app.secret_key = "supersecret"
+# Short‑lived page cache — back‑to‑back refreshes skip the enumeration entirely
+cache = Cache(app, config={"CACHE_TYPE": "SimpleCache"})
+
+
+def _has_flashes() -> bool:
+    """Bypass the page cache while a flash message is pending (it must render once)."""
+    return "_flashes" in session
 
 NAV_ITEMS = [
     ("dashboard", "Dashboard"),
@@ -225,36 +554,24 @@ NAV_ITEMS = [
     ("netload", "Net‑Load"),
 ]
 
-BASE = """<!doctype html><html lang='en'><head><meta charset='utf-8'>
-<link href='https://cdn.jsdelivr.net/npm/bootstrap@5.3.3/dist/css/bootstrap.min.css' rel='stylesheet'>
-<title>WinSysMgmt</title></head>
-<body class='bg-light'>
-<nav class='navbar navbar-expand-lg navbar-dark bg-primary mb-4'>
-  <div class='container-fluid'>
-    <a class='navbar-brand' href='/'>WinSysMgmt</a>
-    <ul class='navbar-nav me-auto mb-2 mb-lg-0'>
-      {% for ep, label in nav %}<li class='nav-item'><a class='nav-link' href='{{ url_for(ep) }}'>{{ label }}</a></li>{% endfor %}
-    </ul>
-  </div>
-</nav>
-<div class='container'>
-  {% with msgs = get_flashed_messages() %}{% if msgs %}<div class='alert alert-info'>{{ msgs[0] }}</div>{% endif %}{% endwith %}
-  {{ body|safe }}
-</div>
-</body></html>"""
-
-
-def render(fragment_tpl: str, **ctx):
-    fragment = render_template_string(fragment_tpl, **ctx)
-    return render_template_string(BASE, body=fragment, nav=NAV_ITEMS)
+
+@app.context_processor
+def _inject_nav():
+    return {"nav": NAV_ITEMS}
 
 # ---------------- Dashboard ---------------------
 @app.route("/")
 @route_log
 def dashboard() -> Response:
-    return render("<h3>Welcome to WinSysMgmt</h3><p>Choose a section from the navbar.</p>")
+    return render_template("dashboard.html")
 
 # ---------------- Processes ---------------------
+@cache.memoize(timeout=2)
+def _process_snapshot():
+    """Short‑lived process list shared by /processes requests (cleared on kill/start)."""
+    return LocalWMIManager.list_processes()
+
+
 @app.route('/processes')
 @route_log
 def processes():
@@ -263,78 +580,41 @@ def processes():
     sort  = request.args.get('sort', 'pid')            # pid | name | cmd
     order = request.args.get('order', 'asc')           # asc | desc
 
-    procs = LocalWMIManager().list_processes()
+    procs = _process_snapshot()
 
     # --- filter by search ---
     if q:
         procs = [
             p for p in procs
-            if q in p['name'].lower() or q in str(p['cmd']).lower()   # ← fix NoneType
+            if q in p['_name_lc'] or q in p['_cmd_lc']
         ]
 
-
     # --- sort by column ---
     if sort in ('pid', 'name', 'cmd'):
-        procs.sort(key=lambda x: str(x[sort]).lower(),
-                   reverse=(order == 'desc'))
-
-    # helper to build sortable headers
-    def hdr(col, label):
-        new_ord = 'desc' if sort == col and order == 'asc' else 'asc'
-        return (f"<a href='?q={q}&sort={col}&order={new_ord}' "
-                f"class='text-white'>{label}</a>")
-
-    # HTML table rows
-    rows = "".join(
-        f"<tr><td>{p['pid']}</td>"
-        f"<td>{p['name']}</td>"
-        f"<td class='text-truncate' style='max-width:300px'>{p['cmd']}</td>"
-        f"<td>"
-        f"<a class='btn btn-sm btn-danger' "
-        f"href='{url_for('kill_process', pid=p['pid'])}'>Kill</a>"
-        f"</td></tr>"
-        for p in procs
-    )
-
-    table = (
-        "<table class='table table-sm table-striped'>"
-        "<thead class='table-primary'>"
-        "<tr>"
-        f"<th>{hdr('pid',  'PID')}</th>"
-        f"<th>{hdr('name', 'Name')}</th>"
-        f"<th>{hdr('cmd',  'Command')}</th>"
-        "<th></th>"
-        "</tr></thead><tbody>"
-        f"{rows}"
-        "</tbody></table>"
-    )
-
-    # search box + launch form
-    search_form = (
-        "<form method='get' class='mb-2'>"
-        "<div class='input-group'>"
-        f"<input name='q' value='{q}' placeholder='Search…' class='form-control'>"
-        "<button class='btn btn-outline-secondary'>Search</button>"
-        "</div></form>"
-    )
-
-    launch_form = (
-        f"<form class='row g-2' method='post' action='{url_for('start_process')}'>"
-        "<div class='col'><input name='exe' placeholder='Executable' required class='form-control'></div>"
-        "<div class='col'><input name='args' placeholder='Args' class='form-control'></div>"
-        "<div class='col-auto'><button class='btn btn-success'>Start</button></div>"
-        "</form>"
-    )
+        procs = sorted(procs, key=itemgetter('pid' if sort == 'pid' else f'_{sort}_lc'),
+                       reverse=(order == 'desc'))
 
-    return render(f"<h3>Processes ({len(procs)})</h3>"
-                  f"{launch_form}{search_form}{table}")
+    # Stream rows straight to the socket. Flashes are consumed now, because
+    # session changes made once the body is streaming never reach the cookie.
+    get_flashed_messages()
+    return Response(stream_template("processes.html", procs=procs, q=q, sort=sort, order=order),
+                    mimetype="text/html")
 
 # ─── Kill process ⟶ /processes/kill/<pid> ───
 @app.route('/processes/kill/<int:pid>')
 @route_log
 def kill_process(pid: int):
-    LocalWMIManager().kill(pid)
-    flash(f'Killed PID {pid}')
+    # Direct TerminateProcess via psutil; LocalWMIManager.kill stays for WMI‑only contexts
+    try:
+        psutil.Process(pid).terminate()
+    except psutil.NoSuchProcess:
+        flash(f'No such PID {pid}')
+    except psutil.AccessDenied:
+        flash(f'Access denied for PID {pid}')
+    else:
+        logger.warning("Kill PID %s", pid)
+        flash(f'Killed PID {pid}')
+    cache.clear()
     return redirect(url_for('processes'))
 # ----------  Launch new executable  ----------
 @app.route("/processes/start", methods=["POST"], endpoint="start_process")
@@ -342,21 +622,18 @@ def kill_process(pid: int):
 def start_process():
     exe  = request.form["exe"]
     args = request.form.get("args", "")
-    pid  = LocalWMIManager().start(exe, args)   # اجرا و دریافت PID
+    pid  = get_wmi().start(exe, args)   # اجرا و دریافت PID
+    cache.clear()
     flash(f"Started PID {pid}")
     return redirect(url_for("processes"))
 
 # ---------------- Services ----------------------
 @app.route("/services")
 @route_log
+@cache.cached(timeout=5, unless=_has_flashes)
 def services() -> Response:
-    svcs = LocalWMIManager().list_services()
-    tbl = "".join(
-        f"<tr><td>{s['name']}</td><td>{s['display']}</td><td>{s['state']}</td><td>{s['mode']}</td></tr>" for s in svcs
-    )
-    return render(
-        f"<h3>Windows Services ({len(svcs)})</h3><table class='table table-sm table-striped'><thead><tr><th>Name</th><th>Display</th><th>State</th><th>Mode</th></tr></thead><tbody>{tbl}</tbody></table>"
-    )
+    svcs = get_wmi().list_services()
+    return render_template("services.html", svcs=svcs)
 
 # ---------------- Remote CMD --------------------
 @app.route("/remote", methods=["GET", "POST"])
@@ -366,20 +643,11 @@ def remote() -> Response:
     if request.method == "POST":
         host = request.form["host"]
         try:
-            mgr = RemoteWinRMManager(host, request.form["user"], request.form["pwd"])
+            mgr = get_winrm(host, request.form["user"], request.form["pwd"])
             output = mgr.run_cmd(request.form["cmd"])
         except Exception as exc:
             output = f"error: {exc}"
-    form = """
-<form method='post' class='row g-2'>
-  <div class='col-3'><input name='host' placeholder='Host' class='form-control' required></div>
-  <div class='col-2'><input name='user' placeholder='User' class='form-control' required></div>
-  <div class='col-2'><input name='pwd' placeholder='Password' type='password' class='form-control' required></div>
-  <div class='col-4'><input name='cmd' placeholder='Command' class='form-control' required></div>
-  <div class='col-auto'><button class='btn btn-primary'>Run</button></div>
-</form>
-"""
-    return render(form + (f"<pre class='bg-dark text-light p-2 mt-3'>{output}</pre>" if output else ""))
+    return render_template("remote.html", output=output)
 
 # ---------------- Single Ping -------------------
 @app.route("/ping", methods=["GET", "POST"], endpoint="ping_single")
@@ -392,13 +660,7 @@ def ping_single() -> Response:
             latency = f"{NetUtils.single_ping(host)} ms"
         except Exception as exc:
             latency = str(exc)
-    form = """
-<form method='post' class='row g-2'>
-  <div class='col-4'><input name='host' placeholder='Host' class='form-control' required></div>
-  <div class='col-auto'><button class='btn btn-success'>Ping</button></div>
-</form>
-"""
-    return render(form + (f"<div class='alert alert-secondary mt-3'>{latency}</div>" if latency else ""))
+    return render_template("ping.html", latency=latency)
 
 # ---------------- Policy Page -------------------
 @app.route("/policy", methods=["GET", "POST"], endpoint="policy_page")
@@ -411,37 +673,23 @@ def policy_page():
             allow = [l.strip() for l in request.form["allowed"].splitlines() if l.strip()]
             block = [l.strip() for l in request.form["blocked"].splitlines() if l.strip()]
             interval = int(request.form.get("interval", 10))
-            if policy: policy.stop()
-            policy = RestrictionPolicy(allow, block, interval)
-            policy.start(); flash("Policy started")
-        elif action == "stop" and policy:
-            policy.stop(); policy = None; flash("Policy stopped")
+            with _state_lock:
+                if policy: policy.stop()
+                policy = RestrictionPolicy(allow, block, interval)
+                policy.start()
+            flash("Policy started")
+        elif action == "stop":
+            with _state_lock:
+                pol, policy = policy, None
+            if pol:
+                pol.stop(); flash("Policy stopped")
         return redirect(url_for("policy_page"))
-    return render(
-        """
-<h3>Restriction Policy</h3>
-<form method='post'>
-  <div class='row'>
-    <div class='col-md-6'>
-      <label class='form-label'>Allowed (whitelist — optional)</label>
-      <textarea name='allowed' rows='6' class='form-control'>{{ allow }}</textarea>
-    </div>
-    <div class='col-md-6'>
-      <label class='form-label'>Not‑Allowed (blacklist — optional)</label>
-      <textarea name='blocked' rows='6' class='form-control'>{{ block }}</textarea>
-    </div>
-  </div>
-  <div class='my-3'><label>Interval (sec)</label>
-    <input name='interval' type='number' value='10' class='form-control' style='width:120px'>
-  </div>
-  {% if active %}<button name='action' value='stop' class='btn btn-danger'>Stop</button>{% endif %}
-  <button name='action' value='start' class='btn btn-primary'>Start / Restart</button>
-</form>
-<p class='mt-3'>Status: {% if active %}<span class='text-success'>ACTIVE</span>{% else %}<span class='text-danger'>inactive</span>{% endif %}</p>
-""",
-        active=policy is not None,
-        allow="\n".join(sorted(policy.allow)) if policy else "",
-        block="\n".join(sorted(policy.block)) if policy else "",
+    pol = policy
+    return render_template(
+        "policy.html",
+        active=pol is not None,
+        allow="\n".join(sorted(pol.allow)) if pol else "",
+        block="\n".join(sorted(pol.block)) if pol else "",
     )
 # ---------------- Net‑Load ----------------------
 @app.route("/netload", methods=["GET", "POST"])
@@ -453,56 +701,69 @@ def netload() -> Response:
         act = request.form["action"]
         if act == "start":
             host = request.form["host"]
-            if net_job:
-                net_job.stop()
-            net_job = NetLoadJob(host)
-            net_job.start()
+            with _state_lock:
+                if net_job:
+                    net_job.stop()
+                net_job = NetLoadJob(host)
+                net_job.start()
             flash(f"Net‑Load started → {host}")
-        elif act == "stop" and net_job:
-            net_job.stop(); net_job = None; flash("Net‑Load stopped")
+        elif act == "stop":
+            with _state_lock:
+                job, net_job = net_job, None
+            if job:
+                job.stop(); flash("Net‑Load stopped")
         return redirect(url_for("netload"))
     # consume queue
-    if net_job and not net_job.q.empty():
-        vals: List[float] = []
-        while not net_job.q.empty():
-            r = net_job.q.get()
-            if r is None:  # sentinel
-                net_job = None; break
-            vals.append(r)
+    job = net_job
+    if job and job.q:
+        vals = job.drain()
+        if None in vals:  # sentinel
+            vals = vals[:vals.index(None)]
+            with _state_lock:
+                if net_job is job:
+                    net_job = None
+            job = None
         if vals:
-            ok = [v for v in vals if v == v]  # filter nan
-            stats = dict(n=len(vals), avg=round(mean(ok), 2) if ok else "nan", last=ok[-1] if ok else "nan")
-    return render(
-        """
-<h3>Network Load</h3>
-<form method='post' class='row g-2'>
-  <div class='col-4'><input name='host' placeholder='Host' class='form-control' {% if job %}value='{{ job.host }}'{% endif %}></div>
-  {% if not job %}<div class='col-auto'><button name='action' value='start' class='btn btn-primary'>Start</button></div>{% else %}<div class='col-auto'><button name='action' value='stop' class='btn btn-danger'>Stop</button></div>{% endif %}
-</form>
-{% if stats %}<div class='alert alert-secondary mt-3'>Avg: {{ stats.avg }} ms over {{ stats.n }} pings — last {{ stats.last }} ms</div>{% endif %}
-""",
-        job=net_job,
+            arr = np.fromiter(vals, dtype=np.float64, count=len(vals))
+            ok = arr[~np.isnan(arr)]  # failed pings are nan
+            stats = dict(
+                n=arr.size,
+                avg=round(float(ok.mean()), 2) if ok.size else "nan",
+                last=float(ok[-1]) if ok.size else "nan",
+            )
+    return render_template(
+        "netload.html",
+        job=job,
         stats=stats,
     )
 
 # JSON endpoint (optional for JS chart)
+def _json(obj) -> Response:
+    return Response(orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY), mimetype="application/json")
+
+
 @app.route("/netload/data")
 @route_log
 def netload_data():
-    if not net_job:
-        return jsonify(active=False)
-    vals = []
-    while not net_job.q.empty():
-        v = net_job.q.get()
-        if v is None:
-            return jsonify(active=False)
-        vals.append(v)
-    return jsonify(active=True, values=vals, ts=time.time())
+    job = net_job
+    if not job:
+        return _json({"active": False})
+    vals = job.drain()  # destructive read — each body is a one‑off batch (empty if nothing new)
+    if None in vals:
+        return _json({"active": False})
+    resp = _json({"active": True, "values": np.fromiter(vals, dtype=np.float64, count=len(vals)), "ts": time.time()})
+    resp.cache_control.no_store = True
+    return resp
 
 # ------------------------------------------------------------------
 if __name__ == "__main__":
     try:
-        app.run(debug=True, port=5000, threaded=False, use_reloader=False)
+        # Threaded WSGI: a slow WMI call no longer blocks other pages. Each worker
+        # thread gets its own COM/WMI context via get_wmi().
+        if waitress is not None:
+            waitress.serve(app, host="127.0.0.1", port=5000, threads=8)
+        else:
+            app.run(port=5000, threaded=True, use_reloader=False)
     finally:
         if policy:
             policy.stop()